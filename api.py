@@ -1,13 +1,31 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import threading
+from contextlib import asynccontextmanager
+from typing import TypedDict
+import asyncio
+import logging
+import tempfile
 import time
-import json
+import orjson
 import os
 
-app = FastAPI(title="Project Timers")
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Événements créés ici pour être liés à la boucle qui exécute l'application
+    stop = asyncio.Event()
+    app.state.dirty = asyncio.Event()
+    flusher = asyncio.create_task(_flusher(stop, app.state.dirty))
+    yield
+    # Le flusher fait lui-même la dernière sauvegarde puis se termine
+    stop.set()
+    app.state.dirty.set()
+    await flusher
+
+app = FastAPI(title="Project Timers", lifespan=lifespan)
 
 # ---- 🔒 CORS configuration ----
 origins = [
@@ -28,32 +46,115 @@ app.add_middleware(
 
 # ---------- Données et stockage ----------
 STATE_FILE = "timers_state.json"
-LOCK = threading.Lock()
+# Lu une fois à l'import : os.umask() ne peut pas être consulté sans le modifier
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FLUSH_DELAY_SEC = 2.0
+STATUS_TTL_SEC = 0.5
+_status_cache: tuple[float, bytes] | None = None  # (time.monotonic(), corps JSON)
 
-class ProjectTimer(BaseModel):
+# Stockage en dicts simples : aucune validation Pydantic au chargement ni à l'écriture
+class ProjectTimer(TypedDict):
     name: str
-    total_seconds: float = 0.0
-    running: bool = False
-    start_time: float | None = None
+    total_seconds: float
+    running: bool
+    start_time: float | None  # time.monotonic() au démarrage
+
+def new_timer(name: str, **fields) -> ProjectTimer:
+    return {"name": name, "total_seconds": 0.0, "running": False, "start_time": None, **fields}
+
+# Sur disque start_time reste une heure murale, valable d'un redémarrage à l'autre
+def _to_monotonic(wall: float) -> float:
+    return time.monotonic() - (time.time() - wall)
+
+def _to_wall(mono: float) -> float:
+    return time.time() - (time.monotonic() - mono)
+
+def _timer_from_file(v: dict) -> ProjectTimer:
+    # Seules les clés connues sont reprises, converties dès le chargement
+    start = v.get("start_time")
+    return new_timer(
+        str(v["name"]),
+        total_seconds=float(v.get("total_seconds", 0.0)),
+        running=bool(v.get("running", False)),
+        start_time=(None if start is None else _to_monotonic(float(start))),
+    )
 
 def load_state() -> dict[int, ProjectTimer]:
     if not os.path.exists(STATE_FILE):
-        return {i: ProjectTimer(name=f"Projet {i}") for i in range(1, 11)}
-    with open(STATE_FILE, "r", encoding="utf-8") as f:
-        raw = json.load(f)
-    timers = {int(k): ProjectTimer(**v) for k, v in raw.items()}
-    return timers
+        return {i: new_timer(f"Projet {i}") for i in range(1, 11)}
+    with open(STATE_FILE, "rb") as f:
+        raw = orjson.loads(f.read())
+    return {int(k): _timer_from_file(v) for k, v in raw.items()}
+
+def snapshot_state(timers: dict[int, ProjectTimer]) -> dict[str, dict]:
+    # Copie légère prise sur la boucle d'événements, sérialisée ensuite dans un thread
+    raw = {str(i): dict(t) for i, t in timers.items()}
+    for v in raw.values():
+        if v["start_time"] is not None:
+            v["start_time"] = _to_wall(v["start_time"])
+    return raw
 
-def save_state(timers: dict[int, ProjectTimer]):
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump({str(i): t.dict() for i, t in timers.items()}, f, ensure_ascii=False, indent=2)
+def save_state(raw: dict[str, dict]):
+    # Fichier temporaire puis remplacement atomique : jamais de JSON tronqué
+    directory = os.path.dirname(os.path.abspath(STATE_FILE))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(raw, option=orjson.OPT_INDENT_2))
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp crée en 0600 : on garde les droits du fichier existant
+        try:
+            mode = os.stat(STATE_FILE).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp, mode)
+        os.replace(tmp, STATE_FILE)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    # Synchroniser le dossier pour que le renommage survive à une coupure (POSIX)
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
+# L'état vit dans la mémoire du processus : lancer uvicorn avec un seul worker
 TIMERS = load_state()
 
-def get_effective_seconds(t: ProjectTimer) -> float:
-    if t.running and t.start_time is not None:
-        return t.total_seconds + (time.time() - t.start_time)
-    return t.total_seconds
+async def _flush(dirty: asyncio.Event):
+    dirty.clear()
+    raw = snapshot_state(TIMERS)
+    try:
+        await asyncio.to_thread(save_state, raw)
+    except Exception:
+        # On garde l'état « sale » pour réessayer au cycle suivant
+        logger.exception("Échec de la sauvegarde de %s", STATE_FILE)
+        dirty.set()
+
+async def _flusher(stop: asyncio.Event, dirty: asyncio.Event):
+    # Écriture différée : au plus une sauvegarde par FLUSH_DELAY_SEC
+    while True:
+        await dirty.wait()
+        if not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), FLUSH_DELAY_SEC)
+            except asyncio.TimeoutError:
+                pass
+        stopping = stop.is_set()
+        await _flush(dirty)
+        if stopping:
+            return
+
+def get_effective_seconds(t: ProjectTimer, now: float | None = None) -> float:
+    if t["running"] and t["start_time"] is not None:
+        if now is None:
+            now = time.monotonic()
+        return t["total_seconds"] + (now - t["start_time"])
+    return t["total_seconds"]
 
 # ---------- API ----------
 class ToggleRequest(BaseModel):
@@ -65,46 +166,49 @@ def index():
     return HTMLResponse("<h2>Interface disponible via /status et /toggle</h2>")
 
 @app.get("/status")
-def get_status():
-    with LOCK:
-        now = time.time()
-        projects = {
-            str(i): {
-                "name": t.name,
-                "total_seconds": get_effective_seconds(t),
-                "running": t.running,
-                "start_time": (now if t.running else None),
-            }
-            for i, t in TIMERS.items()
+async def get_status():
+    global _status_cache
+    # Lecture seule, sans await : pas besoin du verrou sur la boucle d'événements
+    mono = time.monotonic()
+    if _status_cache is not None and mono - _status_cache[0] < STATUS_TTL_SEC:
+        return Response(content=_status_cache[1], media_type="application/json")
+    now = time.time()
+    projects = {
+        str(i): {
+            "name": t["name"],
+            "total_seconds": get_effective_seconds(t, mono),
+            "running": t["running"],
+            "start_time": (now if t["running"] else None),
         }
-        # Mise à jour continue si nécessaire
-        for t in TIMERS.values():
-            if t.running and t.start_time is not None:
-                t.total_seconds += now - t.start_time
-                t.start_time = now
-        save_state(TIMERS)
-    return {"server_time": now, "projects": projects}
+        for i, t in TIMERS.items()
+    }
+    body = orjson.dumps({"server_time": now, "projects": projects})
+    _status_cache = (mono, body)
+    return Response(content=body, media_type="application/json")
 
 @app.post("/toggle/{project_id}")
-def toggle_timer(project_id: int, req: ToggleRequest):
+async def toggle_timer(project_id: int, req: ToggleRequest):
+    global _status_cache
     if project_id not in TIMERS:
         raise HTTPException(status_code=404, detail="Projet inexistant")
-    with LOCK:
-        t = TIMERS[project_id]
-        now = time.time()
-        if not req.running and t.running:
-            if t.start_time:
-                t.total_seconds += now - t.start_time
-            t.start_time = None
-            t.running = False
-        elif req.running and not t.running:
-            t.start_time = now
-            t.running = True
-        save_state(TIMERS)
-        return {
-            "name": t.name,
-            "total_seconds": get_effective_seconds(t),
-            "running": t.running,
-            "start_time": t.start_time,
-        }
+    # Aucun await pendant la mise à jour : elle est atomique sur la boucle d'événements
+    t = TIMERS[project_id]
+    now = time.monotonic()
+    if not req.running and t["running"]:
+        if t["start_time"] is not None:
+            t["total_seconds"] += now - t["start_time"]
+        t["start_time"] = None
+        t["running"] = False
+    elif req.running and not t["running"]:
+        t["start_time"] = now
+        t["running"] = True
+    result = {
+        "name": t["name"],
+        "total_seconds": get_effective_seconds(t, now),
+        "running": t["running"],
+        "start_time": (time.time() if t["running"] else None),
+    }
+    _status_cache = None
+    app.state.dirty.set()
+    return Response(content=orjson.dumps(result), media_type="application/json")
 